@@ -1,15 +1,68 @@
 #!/usr/bin/env python3
-# net_analytics_collector_v1_2.py
+# net_analytics_collector_v1_3.py
 # Collect ping latency to first 3 traceroute hops + dest, and run scheduled speedtests.
-# Logs to SQLite + hourly CSVs for long-term analysis.
+# Logs to SQLite + hourly Parquet (or CSV) files for long-term analysis.
+#
+# Changelog v1.3:
+# - Pings to hop1..hop3 + dest are launched concurrently (asyncio subprocesses), so a cycle
+#   costs ~1 ping timeout instead of 4.
+# - Pings are sent from one in-process ICMP socket (unprivileged SOCK_DGRAM, or SOCK_RAW as root)
+#   with replies matched by sequence number; falls back to the 'ping' command if neither opens.
+# - Ping and traceroute rows are inserted with executemany and committed once per cycle.
+# - SQLite runs with synchronous=NORMAL (+ mmap, larger page cache, wal_autocheckpoint=1000).
+#   Durability trade-off: a power loss (not a process crash) can drop the last few commits,
+#   i.e. a few seconds of samples; the database itself stays consistent.
+# - Traceroute hop IPs are extracted with the optional 'ipextract' package when installed
+#   (regex fallback otherwise); ping RTT is read with a fixed-string split instead of a regex.
+# - Hourly CSV files use a 64 KB write buffer (flushed on hour rotation / shutdown) and the
+#   hour boundary is checked from the row's ts_ms instead of a strftime per row.
+# - which() uses shutil.which (memoized) instead of forking /usr/bin/which.
+# - The daemon is three asyncio tasks: ping_loop, trace_loop and speedtest_loop. Traceroutes and
+#   speedtests no longer stall the ping cadence; speedtests stay single-flight behind a lock.
+#   Waits block on an asyncio.Event set by the signal handler (no 100 ms polling).
+# - INSERT statements are module constants (INS_PING/INS_TRACE/INS_SPEED) so the connection's
+#   statement cache (cached_statements=128) always hits.
+# - CSV rows are written once per cycle with csv.writer.writerows.
+# - Speedtest JSON is parsed straight from stdout bytes, with orjson when installed.
+# - One ts_ms (time.time_ns based) per ping batch; log timestamps use time.strftime.
+# - All SQLite/CSV writes happen on a background Writer thread fed by a bounded queue; it drains
+#   whatever is queued and commits it as one transaction.
+# - Hourly files default to Parquet (HOURLY_FORMAT=parquet, needs pyarrow): int64 timestamps,
+#   dictionary-encoded strings, one file per table per hour folder. HOURLY_FORMAT=csv keeps the
+#   legacy CSVs, which are also used automatically when pyarrow is missing. Rows are routed to
+#   their own (local) hour, and open files are finished every PARQUET_FLUSH_SEC (default 10 min)
+#   so a crash loses at most that much and readers see the current hour.
+# - Traceroute runs in-process (UDP probes with rising TTL + raw ICMP socket for the replies) when
+#   raw sockets are permitted; otherwise the traceroute/mtr commands are used as before.
+# - The 'ping' command fallback sends stderr to /dev/null instead of draining a pipe.
+# - Legacy CSV mode formats ping/traceroute rows directly (one f.write per batch); only
+#   speedtests.csv still goes through csv.writer.
+# - ICMP RTT uses the kernel receive timestamp (SO_TIMESTAMPNS) minus the send time carried in
+#   the echo payload.
+# - Auto-selected speedtest servers are cached in LOG_DIR/.speedtest_servers.json (TTL
+#   SPEEDTEST_INTERVAL_SEC * 10) and the server list is parsed without regexes.
+# - Interval/deadline bookkeeping uses time.monotonic(), so NTP steps can't fire traceroutes or
+#   speedtests early/late; wall-clock time is only used for the ts_ms stored in rows.
+# - Covering indexes pings(ts_ms, tag, success, rtt_ms) and traceroutes(ts_ms, hop, ip) replace
+#   the single-column ts_ms indexes (web UI queries become index-only); ANALYZE runs once when
+#   they are first built.
+# - Ping rollup tables pings_15s / pings_1m / pings_5m / pings_1h (bucket_ts, tag, sum_rtt, succ,
+#   total) are upserted by the Writer in the same transaction as the raw rows, and backfilled from
+#   pings when first created. The web UI reads them for every bucket size it requests.
+# - speedtests gets a covering index (ts_ms + every column the web UI reads) in place of
+#   idx_speed_ts.
+# - Planner statistics stay fresh: PRAGMA optimize at startup, and the Writer re-runs
+#   ANALYZE pings / speedtests every ANALYZE_INTERVAL_SEC (default 1h, analysis_limit=1000).
+# - traceroute_current holds the hops of the latest traceroute (replaced in the same transaction
+#   as each traceroutes insert, backfilled when first created), so the web UI needs no MAX(ts_ms).
 #
 # Changelog v1.2:
 # - LOG_DIR default now "./net_analytics_log" (overridable via env).
 # - Clarified (and kept) strictly sequential speedtest execution; no parallel runs in this process.
 #
 # Usage:
-#   chmod +x net_analytics_collector_v1_2.py
-#   ./net_analytics_collector_v1_2.py
+#   chmod +x net_analytics_collector_v1_3.py
+#   ./net_analytics_collector_v1_3.py
 #
 # Stop with Ctrl+C. Graceful shutdown is handled.
 
@@ -19,12 +72,30 @@ import re
 import csv
 import time
 import json
+import asyncio
 import shlex
 import signal
+import socket
+import queue
+import struct
 import sqlite3
-import subprocess
+import selectors
+import threading
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
+from shutil import which as _sh_which
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import orjson as _json   # optional: faster, parses bytes without a decode step
+except ImportError:
+    import json as _json
 
 # =====================
 # CONFIG (env can override)
@@ -33,12 +104,13 @@ LOG_DIR = os.environ.get("LOG_DIR", "./net_analytics_log")
 DB_PATH = os.environ.get("DB_PATH", os.path.join(LOG_DIR, "net_analytics.db"))
 
 # Destination to traceroute/ping "out to the internet"
-DEST_HOST = os.environ.get("DEST_HOST", "8.8.8.8")
+DEST_HOST = str(os.environ.get("DEST_HOST", "8.8.8.8"))
 
 # Intervals (seconds)
 PING_INTERVAL_SEC = int(os.environ.get("PING_INTERVAL_SEC", "3"))
 TRACEROUTE_REFRESH_SEC = int(os.environ.get("TRACEROUTE_REFRESH_SEC", "300"))   # 5 min
 SPEEDTEST_INTERVAL_SEC = int(os.environ.get("SPEEDTEST_INTERVAL_SEC", "1800"))  # 30 min
+ANALYZE_INTERVAL_SEC = int(os.environ.get("ANALYZE_INTERVAL_SEC", "3600"))      # refresh planner stats
 
 # Speedtest selection
 # Choose tool: "ookla", "speedtest-cli", or "auto" (auto picks whichever is available)
@@ -51,6 +123,8 @@ SPEEDTEST_SERVER_IDS = [s for s in os.environ.get("SPEEDTEST_SERVER_IDS", "").sp
 AUTO_SELECT_SPEEDTEST_SERVERS = os.environ.get("AUTO_SELECT_SPEEDTEST_SERVERS", "true").lower() in ("1","true","yes")
 # How many servers to use if auto-selecting
 AUTO_NUM_SERVERS = int(os.environ.get("AUTO_NUM_SERVERS", "2"))
+# Auto-selected servers are cached here for SPEEDTEST_INTERVAL_SEC * 10 to skip the slow list call on restart
+SPEEDTEST_SERVERS_CACHE = os.path.join(LOG_DIR, ".speedtest_servers.json")
 
 # CSV rollover: separate folder per hour with standardized filenames
 CSV_SUBDIR_FORMAT = "%Y%m%d_%H"  # folder like 20250820_11
@@ -58,39 +132,80 @@ CSV_PINGS_NAME = "pings.csv"
 CSV_TRACES_NAME = "traceroutes.csv"
 CSV_SPEEDTESTS_NAME = "speedtests.csv"
 
+# Hourly file format: "parquet" (columnar, needs pyarrow) or "csv" (legacy). Parquet rows are
+# buffered and written in row groups of PARQUET_ROW_GROUP_ROWS. Open files are finished (footer
+# written, readable) every PARQUET_FLUSH_SEC, when their hour is retired, and on shutdown; the
+# next rows of that hour go to pings.1.parquet etc.
+HOURLY_FORMAT = os.environ.get("HOURLY_FORMAT", "parquet").lower()
+PARQUET_ROW_GROUP_ROWS = int(os.environ.get("PARQUET_ROW_GROUP_ROWS", "10000"))
+PARQUET_FLUSH_SEC = int(os.environ.get("PARQUET_FLUSH_SEC", "600"))
+PARQUET_PINGS_NAME = "pings"
+PARQUET_TRACES_NAME = "traceroutes"
+PARQUET_SPEEDTESTS_NAME = "speedtests"
+
+# Per-probe reply deadline, same as `ping -W 1`
+PING_TIMEOUT_SEC = 1.0
+
 # Verbose logging to stdout
 VERBOSE = os.environ.get("VERBOSE", "1") == "1"
 
 # =====================
 # Helpers
 # =====================
-_shutdown = False
-def _sig_handler(signum, frame):
-    global _shutdown
-    _log(f"[INFO] Received signal {signum}, shutting down...")
-    _shutdown = True
-
 def _log(msg):
     if VERBOSE:
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
         print(f"[{ts}] {msg}", flush=True)
 
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
 
 def _epoch_ms():
-    return int(time.time() * 1000)
+    return time.time_ns() // 1_000_000
 
 def _ensure_dirs():
     Path(LOG_DIR).mkdir(parents=True, exist_ok=True)
 
+def _local_hour(ts_ms):
+    # (start_ms, end_ms, folder name) of the local-time hour containing ts_ms; hour folders are
+    # named in local time, and not every UTC offset is a whole number of hours.
+    start = datetime.fromtimestamp(ts_ms / 1000).replace(minute=0, second=0, microsecond=0)
+    start_ms = int(start.timestamp() * 1000)
+    return start_ms, start_ms + 3_600_000, start.strftime(CSV_SUBDIR_FORMAT)
+
 # =====================
 # SQLite storage
 # =====================
+INS_PING = "INSERT INTO pings (ts_ms, target, tag, rtt_ms, success) VALUES (?, ?, ?, ?, ?)"
+INS_TRACE = "INSERT INTO traceroutes (ts_ms, dest, hop, ip) VALUES (?, ?, ?, ?)"
+INS_TRACE_CURRENT = "INSERT INTO traceroute_current (ts_ms, dest, hop, ip) VALUES (?, ?, ?, ?)"
+INS_SPEED = ("INSERT INTO speedtests (ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+# Per-(bucket, tag) ping rollups: sum of successful RTTs, success count, total count.
+PING_ROLLUPS = tuple(
+    (table, bucket_ms,
+     f"INSERT INTO {table} (bucket_ts, tag, sum_rtt, succ, total) VALUES (?, ?, ?, ?, ?) "
+     "ON CONFLICT(bucket_ts, tag) DO UPDATE SET sum_rtt=sum_rtt+excluded.sum_rtt, "
+     "succ=succ+excluded.succ, total=total+excluded.total")
+    for table, bucket_ms in (("pings_15s", 15_000), ("pings_1m", 60_000), ("pings_5m", 300_000),
+                             ("pings_1h", 3_600_000)))
+
 def init_db(path):
     _ensure_dirs()
-    conn = sqlite3.connect(path, timeout=30)
+    conn = sqlite3.connect(path, timeout=30, cached_statements=128)
     conn.execute("PRAGMA journal_mode=WAL;")
+    have_indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    have_tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    # Trade durability of the last few commits on power loss for far fewer fsyncs (safe with WAL).
+    for pragma in ("PRAGMA synchronous=NORMAL;",
+                   "PRAGMA temp_store=MEMORY;",
+                   "PRAGMA mmap_size=268435456;",      # 256 MiB
+                   "PRAGMA wal_autocheckpoint=1000;",
+                   "PRAGMA cache_size=-20000;"):       # ~20 MiB page cache
+        try:
+            conn.execute(pragma)
+        except sqlite3.DatabaseError as e:
+            _log(f"[WARN] {pragma} not applied: {e}")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS pings (
             ts_ms INTEGER NOT NULL,
@@ -100,7 +215,28 @@ def init_db(path):
             success INTEGER NOT NULL CHECK (success IN (0,1))
         );
     """)
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_pings_ts ON pings(ts_ms);")
+    # covers the web UI's bucketed query (window on ts_ms, reads tag/success/rtt_ms only)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pings_ts_tag_succ_rtt ON pings(ts_ms, tag, success, rtt_ms);")
+    conn.execute("DROP INDEX IF EXISTS idx_pings_ts;")
+
+    for table, bucket_ms, _ in PING_ROLLUPS:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_ts INTEGER NOT NULL,
+                tag TEXT NOT NULL,
+                sum_rtt REAL NOT NULL,  -- over successful pings only
+                succ INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                PRIMARY KEY (bucket_ts, tag)
+            ) WITHOUT ROWID;
+        """)
+        if table not in have_tables:
+            conn.execute(f"""
+                INSERT INTO {table} (bucket_ts, tag, sum_rtt, succ, total)
+                SELECT (ts_ms / {bucket_ms}) * {bucket_ms}, tag,
+                       TOTAL(CASE WHEN success=1 THEN rtt_ms END), SUM(success), COUNT(*)
+                FROM pings GROUP BY 1, 2;
+            """)
     conn.execute("CREATE INDEX IF NOT EXISTS idx_pings_target ON pings(target);")
 
     conn.execute("""
@@ -111,7 +247,23 @@ def init_db(path):
             ip TEXT
         );
     """)
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_ts ON traceroutes(ts_ms);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tr_ts_hop ON traceroutes(ts_ms, hop, ip);")
+    conn.execute("DROP INDEX IF EXISTS idx_traces_ts;")
+    # hops of the most recent traceroute only, replaced on every ingest (what the web UI shows)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS traceroute_current (
+            hop INTEGER PRIMARY KEY,
+            ts_ms INTEGER NOT NULL,
+            dest TEXT NOT NULL,
+            ip TEXT
+        );
+    """)
+    if "traceroute_current" not in have_tables:
+        conn.execute("""
+            INSERT OR REPLACE INTO traceroute_current (hop, ts_ms, dest, ip)
+            SELECT hop, ts_ms, dest, ip FROM traceroutes
+            WHERE ts_ms = (SELECT MAX(ts_ms) FROM traceroutes);
+        """)
 
     conn.execute("""
         CREATE TABLE IF NOT EXISTS speedtests (
@@ -125,53 +277,95 @@ def init_db(path):
             jitter_ms REAL
         );
     """)
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_speed_ts ON speedtests(ts_ms);")
+    # covers the web UI's range reads (every column they select), so no table lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_st_ts_read ON speedtests(ts_ms, server_id, server_name, "
+                 "download_mbps, upload_mbps, tool);")
+    conn.execute("DROP INDEX IF EXISTS idx_st_ts_cover;")   # also carried ping_ms/jitter_ms, which nothing reads
+    conn.execute("DROP INDEX IF EXISTS idx_speed_ts;")
     conn.commit()
+    if not {"idx_pings_ts_tag_succ_rtt", "idx_tr_ts_hop", "idx_st_ts_read"} <= have_indexes:
+        # planner needs stats to prefer the new covering indexes
+        conn.execute("ANALYZE;")
+        conn.commit()
+    try:
+        # 0x10002: check every table, not just ones this connection has queried (SQLite >= 3.46)
+        conn.execute("PRAGMA optimize=0x10002;")
+    except sqlite3.DatabaseError as e:
+        _log(f"[WARN] PRAGMA optimize failed: {e}")
     return conn
 
+def refresh_stats(conn):
+    # Sampled (analysis_limit) so it stays cheap however large the tables grow.
+    try:
+        conn.execute("PRAGMA analysis_limit=1000;")
+        conn.execute("ANALYZE pings;")
+        conn.execute("ANALYZE speedtests;")
+        conn.commit()
+    except sqlite3.DatabaseError as e:
+        _log(f"[WARN] ANALYZE failed: {e}")
+
 # =====================
 # CSV writers per-hour
 # =====================
 class HourlyCSV:
     def __init__(self, base_dir):
         self.base_dir = Path(base_dir)
+        self._hour_start_ms = self._hour_end_ms = 0   # epoch ms bounds of the open (local) hour
         self.current_hour_dir = None
         self.files = {}
 
-    def _hour_dir(self, dt=None):
-        if dt is None:
-            dt = datetime.now()
-        sub = dt.strftime(CSV_SUBDIR_FORMAT)
-        return self.base_dir / sub
-
-    def _ensure_open(self, name, header):
-        hour_dir = self._hour_dir()
-        if self.current_hour_dir != hour_dir:
+    def _ensure_open(self, name, header, ts_ms):
+        # Fast path is a range check on ts_ms; strftime/mkdir only happen on hour rollover.
+        if not self._hour_start_ms <= ts_ms < self._hour_end_ms:
             self._rotate()
-            hour_dir.mkdir(parents=True, exist_ok=True)
-            self.current_hour_dir = hour_dir
-            self.files = {}
+            self._hour_start_ms, self._hour_end_ms, sub = _local_hour(ts_ms)
+            self.current_hour_dir = self.base_dir / sub
+            self.current_hour_dir.mkdir(parents=True, exist_ok=True)
 
         if name not in self.files:
-            fpath = hour_dir / name
-            f = open(fpath, "a", newline="")
+            fpath = self.current_hour_dir / name
+            needs_header = not fpath.exists() or fpath.stat().st_size == 0
+            f = open(fpath, "a", newline="", buffering=1 << 16)
             writer = csv.writer(f)
-            if f.tell() == 0:
+            if needs_header:
                 writer.writerow(header)
             self.files[name] = (f, writer)
 
-        return self.files[name][1]
+        return self.files[name]
 
-    def write_ping(self, ts_ms, target, tag, rtt_ms, success):
-        writer = self._ensure_open(CSV_PINGS_NAME, ["ts_ms", "target", "tag", "rtt_ms", "success"])
-        writer.writerow([ts_ms, target, tag, "" if rtt_ms is None else rtt_ms, success])
+    def _hour_runs(self, rows):
+        # A drained batch can span an hour boundary (e.g. when the writer fell behind), so split it
+        # into runs of consecutive rows from the same local hour.
+        i, n = 0, len(rows)
+        while i < n:
+            ts_ms = rows[i][0]
+            if self._hour_start_ms <= ts_ms < self._hour_end_ms:
+                start, end = self._hour_start_ms, self._hour_end_ms
+            else:
+                start, end, _ = _local_hour(ts_ms)
+            j = i + 1
+            while j < n and start <= rows[j][0] < end:
+                j += 1
+            yield rows[i:j]
+            i = j
+
+    # Ping/trace fields are numbers or plain IPs/tags (nothing to quote), so those rows are
+    # formatted directly and written with a single f.write instead of going through csv.writer.
+    def write_pings_batch(self, rows):
+        # rows: (ts_ms, target, tag, rtt_ms or None, success)
+        for run in self._hour_runs(rows):
+            f, _ = self._ensure_open(CSV_PINGS_NAME, ["ts_ms", "target", "tag", "rtt_ms", "success"], run[0][0])
+            f.write("".join(f"{ts},{target},{tag},{'' if rtt is None else rtt},{ok}\r\n" for ts, target, tag, rtt, ok in run))
 
-    def write_trace(self, ts_ms, dest, hop, ip):
-        writer = self._ensure_open(CSV_TRACES_NAME, ["ts_ms", "dest", "hop", "ip"])
-        writer.writerow([ts_ms, dest, hop, ip or ""])
+    def write_traces_batch(self, rows):
+        # rows: (ts_ms, dest, hop, ip)
+        for run in self._hour_runs(rows):
+            f, _ = self._ensure_open(CSV_TRACES_NAME, ["ts_ms", "dest", "hop", "ip"], run[0][0])
+            f.write("".join(f"{ts},{dest},{hop},{ip or ''}\r\n" for ts, dest, hop, ip in run))
 
     def write_speedtest(self, ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms):
-        writer = self._ensure_open(CSV_SPEEDTESTS_NAME, ["ts_ms","tool","server_id","server_name","ping_ms","download_mbps","upload_mbps","jitter_ms"])
+        # server_name may contain commas, so speedtests keep csv.writer quoting.
+        _, writer = self._ensure_open(CSV_SPEEDTESTS_NAME, ["ts_ms","tool","server_id","server_name","ping_ms","download_mbps","upload_mbps","jitter_ms"], ts_ms)
         writer.writerow([ts_ms, tool, server_id or "", server_name or "", ping_ms or "", download_mbps or "", upload_mbps or "", jitter_ms or ""])
 
     def _rotate(self):
@@ -186,56 +380,392 @@ class HourlyCSV:
     def close(self):
         self._rotate()
 
+# =====================
+# Parquet writers per-hour
+# =====================
+if pa is not None:
+    _DICT_STR = pa.dictionary(pa.int32(), pa.string())
+    PARQUET_SCHEMAS = {
+        PARQUET_PINGS_NAME: pa.schema([("ts_ms", pa.int64()), ("target", _DICT_STR), ("tag", _DICT_STR),
+                                       ("rtt_ms", pa.float64()), ("success", pa.uint8())]),
+        PARQUET_TRACES_NAME: pa.schema([("ts_ms", pa.int64()), ("dest", _DICT_STR), ("hop", pa.int16()),
+                                        ("ip", pa.string())]),
+        PARQUET_SPEEDTESTS_NAME: pa.schema([("ts_ms", pa.int64()), ("tool", _DICT_STR), ("server_id", _DICT_STR),
+                                            ("server_name", _DICT_STR), ("ping_ms", pa.float64()),
+                                            ("download_mbps", pa.float64()), ("upload_mbps", pa.float64()),
+                                            ("jitter_ms", pa.float64())]),
+    }
+
+class HourlyParquet:
+    # Same one-folder-per-hour layout and write_* interface as HourlyCSV, stored column-wise.
+    # Each row goes to its own hour's files; the two newest hours stay open so a speedtest stamped
+    # before the boundary but finishing after it doesn't close and reopen the current hour.
+    def __init__(self, base_dir, row_group_rows=PARQUET_ROW_GROUP_ROWS, flush_sec=PARQUET_FLUSH_SEC):
+        self.base_dir = Path(base_dir)
+        self.row_group_rows = row_group_rows
+        self.flush_sec = flush_sec
+        self.hours = {}     # hour start ms -> (hour end ms, folder)
+        self.buffers = {}   # (hour start ms, name) -> pending rows (tuples in schema order)
+        self.writers = {}   # (hour start ms, name) -> pq.ParquetWriter
+        self._last_flush = time.monotonic()
+
+    def _open_hour(self, ts_ms):
+        for start, (end, _) in self.hours.items():
+            if start <= ts_ms < end:
+                return start, end
+        start, end, sub = _local_hour(ts_ms)
+        folder = self.base_dir / sub
+        folder.mkdir(parents=True, exist_ok=True)
+        self.hours[start] = (end, folder)
+        return start, end
+
+    def _append(self, name, rows):
+        start = end = 0
+        touched = set()
+        for row in rows:
+            if not start <= row[0] < end:
+                start, end = self._open_hour(row[0])
+                key = (start, name)
+                buf = self.buffers.setdefault(key, [])
+                touched.add(key)
+            buf.append(row)
+        for key in touched:
+            if len(self.buffers[key]) >= self.row_group_rows:
+                self._write_row_group(key)
+
+        while len(self.hours) > 2:
+            self._close_hour(min(self.hours))
+        if time.monotonic() - self._last_flush >= self.flush_sec:
+            self._finish_files()
+
+    def _free_path(self, folder, name):
+        # Parquet files can't be appended to; a restart or flush within the same hour gets pings.1.parquet etc.
+        path = folder / f"{name}.parquet"
+        n = 0
+        while path.exists():
+            n += 1
+            path = folder / f"{name}.{n}.parquet"
+        return path
+
+    def _write_row_group(self, key):
+        rows = self.buffers.get(key)
+        if not rows:
+            return
+        start, name = key
+        schema = PARQUET_SCHEMAS[name]
+        table = pa.Table.from_pydict(dict(zip(schema.names, map(list, zip(*rows)))), schema=schema)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.writers[key] = pq.ParquetWriter(str(self._free_path(self.hours[start][1], name)), schema)
+        writer.write_table(table)
+        self.buffers[key] = []
+
+    def _finish(self, keys):
+        # Write what's buffered for keys and close their files.
+        for key in keys:
+            try:
+                self._write_row_group(key)
+            except Exception as e:
+                _log(f"[ERROR] parquet {key[1]}: dropped {len(self.buffers[key])} rows: {e}")
+            self.buffers.pop(key, None)
+            writer = self.writers.pop(key, None)
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception:
+                    pass
+
+    def _finish_files(self):
+        self._finish(list(self.buffers))
+        self._last_flush = time.monotonic()
+
+    def _close_hour(self, start):
+        self._finish([key for key in self.buffers if key[0] == start])
+        del self.hours[start]
+
+    def write_pings_batch(self, rows):
+        # rows: (ts_ms, target, tag, rtt_ms or None, success)
+        if rows:
+            self._append(PARQUET_PINGS_NAME, rows)
+
+    def write_traces_batch(self, rows):
+        # rows: (ts_ms, dest, hop, ip)
+        if rows:
+            self._append(PARQUET_TRACES_NAME, rows)
+
+    def write_speedtest(self, ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms):
+        self._append(PARQUET_SPEEDTESTS_NAME, [(ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms)])
+
+    def close(self):
+        self._finish_files()
+        self.hours = {}
+
+def open_hourly_writer(base_dir):
+    if HOURLY_FORMAT == "parquet":
+        if pa is not None:
+            return HourlyParquet(base_dir)
+        _log("[WARN] HOURLY_FORMAT=parquet but pyarrow is not installed; writing hourly CSVs instead.")
+    return HourlyCSV(base_dir)
+
+# =====================
+# Background writer
+# =====================
+class Writer(threading.Thread):
+    # Owns the SQLite connection and the hourly files so the collector loops never wait on disk.
+    # Items: ("ping", [rows]), ("trace", [rows]), ("speed", row), ("analyze", None); None drains and stops.
+    def __init__(self, db_path, log_dir, maxsize=1024):
+        super().__init__(name="writer", daemon=True)
+        self.db_path = db_path
+        self.log_dir = log_dir
+        self.q = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self._ready = threading.Event()
+
+    def start(self):
+        super().start()
+        self._ready.wait()
+        if self.error:
+            raise self.error
+
+    def put(self, kind, payload):
+        self.q.put((kind, payload))
+
+    def stop(self):
+        self.q.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            conn = init_db(self.db_path)
+            hourly = open_hourly_writer(self.log_dir)
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        done = False
+        while not done:
+            batch = [self.q.get()]
+            while True:
+                try:
+                    batch.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+            pings, traces, speeds = [], [], []
+            analyze = False
+            for item in batch:
+                if item is None:
+                    done = True
+                    continue
+                kind, payload = item
+                if kind == "ping":
+                    pings.extend(payload)
+                elif kind == "trace":
+                    traces.extend(payload)
+                elif kind == "speed":
+                    speeds.append(payload)
+                elif kind == "analyze":
+                    analyze = True
+            try:
+                self._flush(conn, hourly, pings, traces, speeds)
+            except Exception as e:
+                _log(f"[ERROR] writer dropped {len(pings)} ping / {len(traces)} trace / {len(speeds)} speedtest rows: {e}")
+            if analyze:
+                refresh_stats(conn)
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+        hourly.close()
+
+    def _flush(self, conn, hourly, pings, traces, speeds):
+        # One transaction per drained batch; `with conn` rolls it back if any statement fails, so a
+        # failed batch leaves nothing behind for the next commit (and skips the hourly files).
+        with conn:
+            if pings:
+                conn.executemany(INS_PING, pings)
+                for _, bucket_ms, upsert in PING_ROLLUPS:
+                    conn.executemany(upsert, _rollup(pings, bucket_ms))
+            if traces:
+                conn.executemany(INS_TRACE, traces)
+                latest = max(row[0] for row in traces)
+                conn.execute("DELETE FROM traceroute_current;")
+                conn.executemany(INS_TRACE_CURRENT, [row for row in traces if row[0] == latest])
+            if speeds:
+                conn.executemany(INS_SPEED, speeds)
+
+        hourly.write_pings_batch(pings)
+        hourly.write_traces_batch(traces)
+        for row in speeds:
+            hourly.write_speedtest(*row)
+
+def _rollup(pings, bucket_ms):
+    acc = {}
+    for ts_ms, _target, tag, rtt_ms, success in pings:
+        key = (ts_ms - ts_ms % bucket_ms, tag)
+        a = acc.get(key)
+        if a is None:
+            a = acc[key] = [0.0, 0, 0]
+        if success:
+            a[0] += rtt_ms
+            a[1] += 1
+        a[2] += 1
+    return [(b, tag, a[0], a[1], a[2]) for (b, tag), a in acc.items()]
+
 # =====================
 # Command helpers
 # =====================
+@lru_cache(maxsize=32)
 def which(cmd):
+    return _sh_which(cmd) is not None
+
+def _kill(proc):
     try:
-        out = subprocess.run(["which", cmd], capture_output=True, text=True)
-        return out.returncode == 0
-    except Exception:
-        return False
+        proc.kill()
+    except ProcessLookupError:
+        pass  # already exited (e.g. it got the same Ctrl+C as we did)
 
-def run_cmd(cmd, timeout_sec=30):
+async def run_cmd_bytes(cmd, timeout_sec=30, want_stderr=True):
+    # stdout is returned undecoded (for JSON parsers that take bytes); stderr is always text,
+    # or "" when the caller doesn't want it (then it goes to /dev/null instead of a pipe).
+    stderr = asyncio.subprocess.PIPE if want_stderr else asyncio.subprocess.DEVNULL
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+    except OSError as e:
+        return 127, b"", str(e)
     try:
-        res = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_sec)
-        return res.returncode, res.stdout, res.stderr
-    except subprocess.TimeoutExpired:
-        return 124, "", "timeout"
+        out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout_sec)
+    except asyncio.TimeoutError:
+        _kill(proc)
+        await proc.wait()
+        return 124, b"", "timeout"
+    except asyncio.CancelledError:
+        _kill(proc)
+        await proc.wait()  # reap it before the loop goes away
+        raise
+    return proc.returncode, out, err.decode(errors="replace") if err else ""
+
+async def run_cmd_async(cmd, timeout_sec=30, want_stderr=True):
+    rc, out, err = await run_cmd_bytes(cmd, timeout_sec, want_stderr)
+    return rc, out.decode(errors="replace"), err
 
 # =====================
 # Traceroute
 # =====================
 IP_RE = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})")
 
-def do_traceroute(dest):
+# Optional: DFA-based extractor with strict octet validation (rejects 256.1.2.3, 1.2.3.4.5).
+try:
+    import ipextract
+    _IPX = ipextract.Extractor(ipv6=False)
+except ImportError:
+    _IPX = None
+
+def _first_ips(text, limit=3):
+    hops = []
+    if _IPX is not None:
+        for ip in _IPX.extract(text):
+            hops.append(ip)
+            if len(hops) >= limit:
+                break
+        return hops
+    for line in text.splitlines():
+        m = IP_RE.search(line)
+        if m:
+            hops.append(m.group(1))
+        if len(hops) >= limit:
+            break
+    return hops
+
+TRACE_BASE_PORT = 33434
+TRACE_DEADLINE_SEC = 30   # whole run, same cap as the traceroute/mtr commands
+TRACE_POLL_SEC = 0.25     # how often a waiting probe checks for shutdown
+ICMP_DEST_UNREACH = 3
+ICMP_TIME_EXCEEDED = 11
+
+def _await_hop_reply(icmp, sel, dest_ip, sport, dport, deadline, cancel):
+    # Wait for the TIME_EXCEEDED / DEST_UNREACH that quotes our probe; returns (hop_ip, reached_dest).
+    # Gives up at deadline (monotonic) or once cancel is set.
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or cancel.is_set():
+            return None, False
+        if not sel.select(min(remaining, TRACE_POLL_SEC)):
+            continue
+        try:
+            pkt, _ = icmp.recvfrom(2048)
+        except (BlockingIOError, InterruptedError):
+            continue
+        ihl = (pkt[0] & 0x0F) * 4
+        if len(pkt) < ihl + 8 + 20 + 4 or pkt[ihl] not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACH):
+            continue
+        inner = pkt[ihl + 8:]
+        inner_ihl = (inner[0] & 0x0F) * 4
+        if inner[9] != socket.IPPROTO_UDP or socket.inet_ntoa(inner[16:20]) != dest_ip or len(inner) < inner_ihl + 4:
+            continue
+        if struct.unpack_from("!HH", inner, inner_ihl) != (sport, dport):
+            continue
+        return socket.inet_ntoa(pkt[12:16]), pkt[ihl] == ICMP_DEST_UNREACH
+
+def do_traceroute_py(dest, cancel, max_hops=3, timeout=2.0, max_ttl=30, deadline_sec=TRACE_DEADLINE_SEC):
+    # Minimal in-process traceroute: UDP probes with TTL=1,2,.. and a raw ICMP socket for the
+    # replies. Like `traceroute -q 1`, silent hops are skipped. Returns None when raw sockets are
+    # not permitted so the caller can fall back to the traceroute/mtr commands.
+    # Runs in a worker thread, which can't be cancelled: it stops at deadline_sec or when cancel
+    # (a threading.Event) is set, with whatever hops it has found.
+    try:
+        icmp = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    except OSError:
+        return None
+    hops = []
+    try:
+        dest_ip = socket.gethostbyname(dest)
+        trace_deadline = time.monotonic() + deadline_sec
+        with icmp, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp, selectors.DefaultSelector() as sel:
+            icmp.setblocking(False)
+            sel.register(icmp, selectors.EVENT_READ)
+            udp.bind(("", 0))
+            sport = udp.getsockname()[1]
+            for ttl in range(1, max_ttl + 1):
+                if cancel.is_set() or time.monotonic() >= trace_deadline:
+                    break
+                dport = TRACE_BASE_PORT + ttl
+                udp.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+                udp.sendto(b"", (dest_ip, dport))
+                deadline = min(time.monotonic() + timeout, trace_deadline)
+                hop_ip, reached = _await_hop_reply(icmp, sel, dest_ip, sport, dport, deadline, cancel)
+                if hop_ip:
+                    hops.append(hop_ip)
+                if reached or len(hops) >= max_hops:
+                    break
+    except OSError as e:
+        _log(f"[WARN] In-process traceroute to {dest} failed: {e}")
+    return hops
+
+async def do_traceroute(dest, cancel):
+    hops = await asyncio.to_thread(do_traceroute_py, dest, cancel)
+    if hops is not None:
+        _log(f"[TRACE] in-process UDP probe to {dest}")
+        return hops
+
     if which("traceroute"):
         cmd = ["traceroute", "-n", "-w", "2", "-q", "1", dest]
         _log(f"[TRACE] {' '.join(cmd)}")
-        rc, out, err = run_cmd(cmd, timeout_sec=30)
-        hops = []
+        rc, out, err = await run_cmd_async(cmd, timeout_sec=30)
         if rc == 0 and out:
-            for line in out.splitlines()[1:]:
-                m = IP_RE.search(line)
-                if m:
-                    hops.append(m.group(1))
-                if len(hops) >= 3:
-                    break
-        return hops
+            # first line is the "traceroute to <dest> (<ip>)" banner
+            return _first_ips(out.partition("\n")[2])
+        return []
 
     elif which("mtr"):
         cmd = ["mtr", "-n", "-r", "-c", "1", dest]
         _log(f"[TRACE] {' '.join(cmd)}")
-        rc, out, err = run_cmd(cmd, timeout_sec=30)
-        hops = []
+        rc, out, err = await run_cmd_async(cmd, timeout_sec=30)
         if rc == 0 and out:
-            for line in out.splitlines():
-                m = IP_RE.search(line)
-                if m:
-                    hops.append(m.group(1))
-                if len(hops) >= 3:
-                    break
-        return hops
+            return _first_ips(out)
+        return []
 
     else:
         _log("[WARN] Neither 'traceroute' nor 'mtr' found. Install one of them.")
@@ -244,15 +774,123 @@ def do_traceroute(dest):
 # =====================
 # Ping
 # =====================
-def do_ping(ip):
+async def do_ping(ip):
     cmd = ["ping", "-n", "-c", "1", "-W", "1", ip]
-    rc, out, err = run_cmd(cmd, timeout_sec=5)
+    rc, out, _ = await run_cmd_async(cmd, timeout_sec=5, want_stderr=False)
     if rc == 0 and "time=" in out:
-        m = re.search(r"time[=<]\s*([\d\.]+)\s*ms", out)
-        if m:
-            return True, float(m.group(1))
+        try:
+            return True, float(out.partition("time=")[2].split(" ms", 1)[0])
+        except ValueError:
+            pass
     return False, None
 
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+# Not exported by the socket module; 35 is the Linux value (SCM_TIMESTAMPNS == SO_TIMESTAMPNS).
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+
+def _icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+class Pinger:
+    # One ICMP socket for all targets: echo requests go out back-to-back and replies are
+    # matched by sequence number, so a cycle needs no fork/exec and no stdout parsing.
+    def __init__(self, sock, raw):
+        self.sock = sock
+        self.raw = raw      # SOCK_RAW replies carry the IP header; SOCK_DGRAM ones don't
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+        # Kernel receive timestamps take scheduler wake-up latency out of the RTT. They are
+        # CLOCK_REALTIME, so the send time in the payload is time.time_ns() to match.
+        self.kernel_ts = False
+        if SO_TIMESTAMPNS is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_ts = True
+            except OSError:
+                pass
+
+    @classmethod
+    def open(cls):
+        # Unprivileged ICMP (SOCK_DGRAM) needs net.ipv4.ping_group_range; SOCK_RAW needs root/CAP_NET_RAW.
+        for kind, raw in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+            try:
+                sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            return cls(sock, raw)
+        return None
+
+    def _packet(self, seq):
+        payload = struct.pack("!q", time.time_ns()).ljust(16, b"\x00")
+        header = bytearray(struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, seq))
+        struct.pack_into("!H", header, 2, _icmp_checksum(bytes(header) + payload))
+        return bytes(header) + payload
+
+    def ping_many(self, ips, timeout=PING_TIMEOUT_SEC):
+        results = [(False, None)] * len(ips)
+        pending = {}
+        for i, ip in enumerate(ips):
+            self.seq = (self.seq + 1) & 0xFFFF
+            try:
+                self.sock.sendto(self._packet(self.seq), (ip, 0))
+            except OSError:
+                continue
+            pending[self.seq] = i
+
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.sock, selectors.EVENT_READ)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not sel.select(remaining):
+                    break
+                while pending:
+                    try:
+                        pkt, ancdata, _, _ = self.sock.recvmsg(2048, socket.CMSG_SPACE(16))
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    recv_ns = self._recv_ns(ancdata)
+                    if self.raw:
+                        pkt = pkt[(pkt[0] & 0x0F) * 4:]
+                    if len(pkt) < 16:
+                        continue
+                    icmp_type, _, _, ident, seq = struct.unpack_from("!BBHHH", pkt)
+                    # DGRAM sockets get their id rewritten by the kernel and only see their own replies.
+                    if icmp_type != ICMP_ECHO_REPLY or (self.raw and ident != self.ident):
+                        continue
+                    i = pending.pop(seq, None)
+                    if i is None:
+                        continue
+                    sent_ns = struct.unpack_from("!q", pkt, 8)[0]
+                    results[i] = (True, (recv_ns - sent_ns) / 1e6)
+        return results
+
+    def _recv_ns(self, ancdata):
+        if self.kernel_ts:
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= 16:
+                    sec, nsec = struct.unpack("qq", data[:16])
+                    return sec * 1_000_000_000 + nsec
+        return time.time_ns()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+async def ping_targets(pinger, ips):
+    if pinger:
+        return await asyncio.to_thread(pinger.ping_many, ips)
+    return await asyncio.gather(*(do_ping(ip) for ip in ips))
+
 # =====================
 # Speedtest
 # =====================
@@ -271,38 +909,67 @@ def which_speedtest_tool():
         return "speedtest-cli" if which("speedtest-cli") else None
     return None
 
-def auto_select_servers(tool, count):
+def _parse_server_list(out, count, max_lines=None):
+    # Lines look like "  1234) Sponsor (City, CC)"
+    servers = []
+    for line in out.splitlines()[:max_lines]:
+        sid, sep, name = line.strip().partition(")")
+        if sep and sid.isdigit() and name.strip():
+            servers.append({"id": sid, "name": name.strip()})
+            if len(servers) >= count:
+                break
+    return servers
+
+def _load_cached_servers(tool, count):
+    try:
+        data = json.loads(Path(SPEEDTEST_SERVERS_CACHE).read_text())
+    except (OSError, ValueError):
+        return None
+    if data.get("tool") != tool or _epoch_ms() >= data.get("expires_ms", 0):
+        return None
+    servers = data.get("servers") or []
+    # a shorter list is fine if it's everything the list command had when asked for `count`
+    if len(servers) >= count or data.get("count") == count:
+        return servers[:count] or None
+    return None
+
+def _save_cached_servers(tool, count, servers):
+    data = {"tool": tool, "count": count, "expires_ms": _epoch_ms() + SPEEDTEST_INTERVAL_SEC * 10 * 1000,
+            "servers": servers}
+    try:
+        Path(SPEEDTEST_SERVERS_CACHE).write_text(json.dumps(data))
+    except OSError as e:
+        _log(f"[WARN] Could not cache speedtest server list: {e}")
+
+async def auto_select_servers(tool, count):
+    cached = _load_cached_servers(tool, count)
+    if cached:
+        _log(f"[INFO] Using cached speedtest server list ({SPEEDTEST_SERVERS_CACHE}).")
+        return cached
+
     servers = []
     if tool == "ookla":
-        rc, out, err = run_cmd(["speedtest", "-L"], timeout_sec=20)
+        rc, out, err = await run_cmd_async(["speedtest", "-L"], timeout_sec=20)
         if rc == 0:
-            for line in out.splitlines():
-                m = re.match(r"\s*(\d+)\)\s*(.+)", line.strip())
-                if m:
-                    servers.append({"id": m.group(1), "name": m.group(2)})
-                    if len(servers) >= count:
-                        break
+            servers = _parse_server_list(out, count)
     elif tool == "speedtest-cli":
-        rc, out, err = run_cmd(["speedtest-cli", "--list"], timeout_sec=25)
+        rc, out, err = await run_cmd_async(["speedtest-cli", "--list"], timeout_sec=25)
         if rc == 0:
-            for line in out.splitlines()[:200]:
-                m = re.match(r"\s*(\d+)\)\s*(.+)", line.strip())
-                if m:
-                    servers.append({"id": m.group(1), "name": m.group(2)})
-                    if len(servers) >= count:
-                        break
+            servers = _parse_server_list(out, count, max_lines=200)
+    if servers:
+        _save_cached_servers(tool, count, servers)
     return servers
 
-def run_speedtest(tool, server_id=None):
-    # NOTE: Called synchronously; this process never runs speedtests in parallel.
+async def run_speedtest(tool, server_id=None):
+    # NOTE: Serialized by speedtest_loop's lock; this process never runs speedtests in parallel.
     if tool == "ookla":
         base = ["speedtest", "--format=json"]
         if server_id:
             base += ["--server-id", str(server_id)]
-        rc, out, err = run_cmd(base, timeout_sec=120)
+        rc, out, err = await run_cmd_bytes(base, timeout_sec=120)
         if rc == 0 and out.strip():
             try:
-                data = json.loads(out)
+                data = _json.loads(out)
                 ping_ms = (data.get("ping") or {}).get("latency")
                 jitter_ms = (data.get("ping") or {}).get("jitter")
                 down_bps = (data.get("download") or {}).get("bandwidth")
@@ -327,10 +994,10 @@ def run_speedtest(tool, server_id=None):
         base = ["speedtest-cli", "--json"]
         if server_id:
             base += ["--server", str(server_id)]
-        rc, out, err = run_cmd(base, timeout_sec=180)
+        rc, out, err = await run_cmd_bytes(base, timeout_sec=180)
         if rc == 0 and out.strip():
             try:
-                data = json.loads(out)
+                data = _json.loads(out)
                 ping_ms = data.get("ping")
                 download_mbps = (data.get("download") or 0) / 1e6
                 upload_mbps = (data.get("upload") or 0) / 1e6
@@ -356,20 +1023,98 @@ def run_speedtest(tool, server_id=None):
 # =====================
 # Main loop
 # =====================
-def main():
-    global _shutdown
-    signal.signal(signal.SIGINT, _sig_handler)
-    signal.signal(signal.SIGTERM, _sig_handler)
+def _sig_handler(signum, stop):
+    _log(f"[INFO] Received signal {signum}, shutting down...")
+    stop.set()
 
-    _ensure_dirs()
+async def _wait_stop(stop, timeout_sec):
+    # True if shutdown was requested before timeout_sec elapsed.
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=max(0.0, timeout_sec))
+    except asyncio.TimeoutError:
+        pass
+    return stop.is_set()
 
-    conn = init_db(DB_PATH)
-    cur = conn.cursor()
-    csvw = HourlyCSV(LOG_DIR)
+async def trace_loop(stop, writer, hop_ips, trace_cancel):
+    while not stop.is_set():
+        started = time.monotonic()
+        hops = await do_traceroute(DEST_HOST, trace_cancel)
+        ts_ms = _epoch_ms()
+        hop_ips[:] = hops[:3]
+        _log(f"[TRACE] Hops: {hop_ips or '(none)'}")
+        if hop_ips:
+            writer.put("trace", [(ts_ms, DEST_HOST, i, ip) for i, ip in enumerate(hop_ips, start=1)])
 
-    last_trace_ts = 0
-    last_speedtest_ts = 0
-    hop_ips = []
+        # Until hops are known, retry on the ping cadence (as before).
+        interval = TRACEROUTE_REFRESH_SEC if hop_ips else PING_INTERVAL_SEC
+        if await _wait_stop(stop, interval - (time.monotonic() - started)):
+            break
+
+async def ping_loop(stop, writer, pinger, hop_ips):
+    while not stop.is_set():
+        targets = []
+        for idx, ip in enumerate(hop_ips, start=1):
+            targets.append((ip, f"hop{idx}"))
+        targets.append((DEST_HOST, "dest"))
+
+        # All targets are probed from the same instant, so one ts_ms covers the whole batch.
+        ts_ms = _epoch_ms()
+        results = await ping_targets(pinger, [ip for ip, _ in targets])
+        ping_rows = []
+        for (ip, tag), (ok, rtt) in zip(targets, results):
+            ping_rows.append((ts_ms, ip, tag, rtt if ok else None, 1 if ok else 0))
+            if ok:
+                _log(f"[PING] {tag} {ip} {rtt:.2f} ms")
+            else:
+                _log(f"[PING] {tag} {ip} LOST")
+        writer.put("ping", ping_rows)
+
+        if await _wait_stop(stop, PING_INTERVAL_SEC):
+            break
+
+def _record_speedtest(writer, ts_ms, server_id, res):
+    if "error" in res:
+        if server_id:
+            _log(f"[SPEEDTEST] error with server {server_id}: {res['error']}")
+        else:
+            _log(f"[SPEEDTEST] error: {res['error']}")
+        return
+    _log(f"[SPEEDTEST] {res['server_id']} {res['server_name']} down={res['download_mbps']:.2f} Mbps up={res['upload_mbps']:.2f} Mbps ping={res['ping_ms']:.1f} ms")
+    writer.put("speed", (ts_ms, res.get("tool"), res.get("server_id"), res.get("server_name"), res.get("ping_ms"), res.get("download_mbps"), res.get("upload_mbps"), res.get("jitter_ms")))
+
+async def speedtest_loop(stop, writer, tool, servers, lock):
+    while not stop.is_set():
+        started = time.monotonic()
+        # Speedtests: strictly sequential. If multiple servers configured, run them one-by-one.
+        # The lock keeps runs single-flight; pings and traceroutes keep going meanwhile.
+        async with lock:
+            for s in (servers or [{}]):
+                ts_ms = _epoch_ms()
+                res = await run_speedtest(tool, s.get("id"))
+                _record_speedtest(writer, ts_ms, s.get("id"), res)
+                if stop.is_set():
+                    break
+
+        if await _wait_stop(stop, SPEEDTEST_INTERVAL_SEC - (time.monotonic() - started)):
+            break
+
+async def analyze_loop(stop, writer):
+    # Runs on the Writer thread (its connection, no lock contention with inserts).
+    while not await _wait_stop(stop, ANALYZE_INTERVAL_SEC):
+        writer.put("analyze", None)
+
+async def run():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, _sig_handler, signum, stop)
+
+    _ensure_dirs()
+
+    writer = Writer(DB_PATH, LOG_DIR)
+    writer.start()
+    hop_ips = []  # shared: written by trace_loop, read by ping_loop
+    trace_cancel = threading.Event()  # stops an in-process traceroute thread on shutdown
 
     tool = which_speedtest_tool()
     if not tool:
@@ -379,93 +1124,52 @@ def main():
     if tool and SPEEDTEST_SERVER_IDS:
         servers = [{"id": sid.strip(), "name": ""} for sid in SPEEDTEST_SERVER_IDS]
     elif tool and AUTO_SELECT_SPEEDTEST_SERVERS:
-        servers = auto_select_servers(tool, AUTO_NUM_SERVERS)
+        servers = await auto_select_servers(tool, AUTO_NUM_SERVERS)
         if not servers:
             _log("[WARN] Could not auto-select speedtest servers; will use tool's default when running.")
 
-    _log(f"[START] Logging to DB: {DB_PATH}  CSV dir: {LOG_DIR}")
+    pinger = Pinger.open()
+    if pinger:
+        _log(f"[INFO] Using in-process ICMP pinger ({'raw' if pinger.raw else 'unprivileged'} socket).")
+    else:
+        _log("[INFO] ICMP socket unavailable; falling back to the 'ping' command.")
+
+    _log(f"[START] Logging to DB: {DB_PATH}  hourly files dir: {LOG_DIR}")
     _log(f"[CONFIG] DEST_HOST={DEST_HOST} PING_INTERVAL_SEC={PING_INTERVAL_SEC} TRACEROUTE_REFRESH_SEC={TRACEROUTE_REFRESH_SEC} SPEEDTEST_INTERVAL_SEC={SPEEDTEST_INTERVAL_SEC}")
     if tool:
         _log(f"[CONFIG] SPEEDTEST_TOOL={tool} servers={','.join([s['id'] for s in servers]) or '(default)'}")
         _log("[INFO] Speedtests execute sequentially in this process; no parallel runs.")
 
-    while not _shutdown:
-        now = time.time()
-
-        if now - last_trace_ts >= TRACEROUTE_REFRESH_SEC or not hop_ips:
-            hops = do_traceroute(DEST_HOST)
-            ts_ms = _epoch_ms()
-            hop_ips = hops[:3]
-            _log(f"[TRACE] Hops: {hop_ips or '(none)'}")
-            for i, ip in enumerate(hop_ips, start=1):
-                cur.execute("INSERT INTO traceroutes (ts_ms, dest, hop, ip) VALUES (?, ?, ?, ?)", (ts_ms, str(DEST_HOST), i, ip))
-                csvw.write_trace(ts_ms, str(DEST_HOST), i, ip)
-            conn.commit()
-            last_trace_ts = now
-
-        targets = []
-        for idx, ip in enumerate(hop_ips, start=1):
-            targets.append((ip, f"hop{idx}"))
-        targets.append((DEST_HOST, "dest"))
-
-        for ip, tag in targets:
-            ts_ms = _epoch_ms()
-            ok, rtt = do_ping(ip)
-            cur.execute("INSERT INTO pings (ts_ms, target, tag, rtt_ms, success) VALUES (?, ?, ?, ?, ?)", (ts_ms, ip, tag, rtt if ok else None, 1 if ok else 0))
-            csvw.write_ping(ts_ms, ip, tag, rtt if ok else None, 1 if ok else 0)
-            if ok:
-                _log(f"[PING] {tag} {ip} {rtt:.2f} ms")
-            else:
-                _log(f"[PING] {tag} {ip} LOST")
-
-            if _shutdown:
-                break
-
-        conn.commit()
+    tasks = [
+        asyncio.create_task(ping_loop(stop, writer, pinger, hop_ips)),
+        asyncio.create_task(trace_loop(stop, writer, hop_ips, trace_cancel)),
+        asyncio.create_task(analyze_loop(stop, writer)),
+    ]
+    if tool:
+        tasks.append(asyncio.create_task(speedtest_loop(stop, writer, tool, servers, asyncio.Lock())))
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        # Returns on shutdown, or early if a loop died with an exception.
+        await asyncio.wait([stopper, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # In-flight traceroute/speedtest subprocesses are killed by cancellation; the in-process
+        # traceroute thread (which asyncio.run would otherwise wait for) is told to stop.
+        trace_cancel.set()
+        for t in (stopper, *tasks):
+            t.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Sentinel goes in after the loops are gone, so nothing queued is lost.
+        writer.stop()
+        if pinger:
+            pinger.close()
+        _log("[EXIT] Collector stopped.")
 
-        # Speedtests: strictly sequential. If multiple servers configured, run them one-by-one.
-        if tool and (now - last_speedtest_ts >= SPEEDTEST_INTERVAL_SEC):
-            if servers:
-                for s in servers:
-                    ts_ms = _epoch_ms()
-                    res = run_speedtest(tool, s.get("id"))
-                    if "error" in res:
-                        _log(f"[SPEEDTEST] error with server {s.get('id')}: {res['error']}")
-                    else:
-                        _log(f"[SPEEDTEST] {res['server_id']} {res['server_name']} down={res['download_mbps']:.2f} Mbps up={res['upload_mbps']:.2f} Mbps ping={res['ping_ms']:.1f} ms")
-                        cur.execute("""INSERT INTO speedtests (ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms)
-                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                                    (ts_ms, res.get("tool"), res.get("server_id"), res.get("server_name"), res.get("ping_ms"), res.get("download_mbps"), res.get("upload_mbps"), res.get("jitter_ms")))
-                        csvw.write_speedtest(ts_ms, res.get("tool"), res.get("server_id"), res.get("server_name"), res.get("ping_ms"), res.get("download_mbps"), res.get("upload_mbps"), res.get("jitter_ms"))
-                    conn.commit()
-                    if _shutdown:
-                        break
-            else:
-                ts_ms = _epoch_ms()
-                res = run_speedtest(tool, None)
-                if "error" in res:
-                    _log(f"[SPEEDTEST] error: {res['error']}")
-                else:
-                    _log(f"[SPEEDTEST] {res['server_id']} {res['server_name']} down={res['download_mbps']:.2f} Mbps up={res['upload_mbps']:.2f} Mbps ping={res['ping_ms']:.1f} ms")
-                    cur.execute("""INSERT INTO speedtests (ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms)
-                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                                (ts_ms, res.get("tool"), res.get("server_id"), res.get("server_name"), res.get("ping_ms"), res.get("download_mbps"), res.get("upload_mbps"), res.get("jitter_ms")))
-                    csvw.write_speedtest(ts_ms, res.get("tool"), res.get("server_id"), res.get("server_name"), res.get("ping_ms"), res.get("download_mbps"), res.get("upload_mbps"), res.get("jitter_ms"))
-                conn.commit()
-            last_speedtest_ts = now
-
-        for _ in range(PING_INTERVAL_SEC * 10):
-            if _shutdown:
-                break
-            time.sleep(0.1)
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
 
-    try:
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
-    csvw.close()
-    _log("[EXIT] Collector stopped.")
+def main():
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,51 @@
 #!/usr/bin/env python3
-# net_analytics_webui_standalone_v1_5.py
+# net_analytics_webui_standalone_v1_6.py
+#
+# Changes vs v1.5:
+# - Bucketed /api/pings responses are cached as gzipped compact JSON, keyed on the bucket-aligned
+#   window + bucket size + DB mtime (so new samples invalidate). Sent as Content-Encoding: gzip when
+#   the client accepts it, decompressed otherwise.
+# - One read-only SQLite connection per server thread (URI mode=ro, query_only, mmap, 64 MB page
+#   cache, in-memory temp store) instead of connect/close per query; ThreadingHTTPServer so
+#   concurrent polls don't queue behind each other.
+# - Latest traceroute is one query (MAX(ts_ms) as a subquery).
+# - Bucketed pings are read from the collector's pings_1m/5m/1h rollups when one divides bucket_ms
+#   (raw pings otherwise, or when the DB predates the rollups). Response format unchanged.
+# - Bucketed /api/pings is columnar: one set of parallel arrays per tag instead of one
+#   [ts, tag, avg, succ, total] array per bucket.
+# - Other JSON responses are streamed with iterencode (in ~64 KB pieces, gzip level 1 on the fly
+#   when accepted) instead of being built as one string; compact separators throughout.
+# - Dest avg latency / packet loss for the tiles are computed server-side and returned as
+#   "stats" next to "tags" (the browser no longer reduces the dest series itself).
+# - Speedtest tooltip looks rows up in a Map by timestamp; window averages binary-search the
+#   (already ts-sorted) rows for their cutoff instead of filtering the whole array.
+# - Bucketed ping series longer than MAX_POINTS_PER_SERIES are downsampled server-side with LTTB
+#   (keeps spikes, unlike the old every-Nth-point thin()); needs numpy, otherwise series are sent
+#   whole and the chart's own decimation handles them.
+# - 15s/30s buckets (windows up to 24h) come from the collector's pings_15s rollup as well.
+# - The dashboard page is encoded (and gzipped) once at startup and served with an ETag and
+#   Cache-Control: max-age=60; revalidations get 304 Not Modified.
+# - Requests run on a fixed pool of HTTP_WORKERS threads (default 8) instead of a new thread per
+#   request, bounding concurrency and letting each worker keep its SQLite connection.
+# - /api/speedtests is columnar too: server name/tool once per server id, then parallel ts/sid/
+#   down/up arrays (ping and jitter, which the dashboard never plotted, are no longer sent).
+# - HTTP/1.1 keep-alive with TCP_NODELAY. Every response carries Content-Length, except JSON
+#   larger than 64 KB, which streams with chunked transfer encoding. Idle keep-alive
+#   connections are dropped after 10s so they don't hold pool workers.
+# - 15m / 1h / 24h speedtest averages come from /api/speedtests_windows (one SQL query) instead
+#   of being recomputed in the browser; "24h" is now a true 24h even when the window is shorter.
+# - Auto-refresh fetches only new ping buckets (since_ms=<last bucket seen>) and merges them into
+#   the live chart, trimming points that fell out of the window; full reload on Apply / first
+#   paint. Hop toggles just show/hide datasets locally.
+# - Bucketed /api/pings can be fetched as packed little-endian binary (fmt=bin), which the
+#   dashboard now uses: no float formatting on the server, typed-array views in the browser.
+# - Query functions take the request's connection (fetched once per request) and use module-level
+#   SQL constants, so all of a request's statements share one connection and its statement cache.
+# - Charts render without animation or line smoothing, with parsing off and datasets marked
+#   normalized (data is already x-sorted); Chart.js decimation only runs when a series is
+#   longer than its threshold.
+# - Latest traceroute is read from the collector's traceroute_current table (a few rows, no
+#   MAX(ts_ms)); DBs without it fall back to the traceroutes query.
 #
 # Changes vs v1.4:
 # - Remembers hop toggle selections across auto-refresh & reload (localStorage).
@@ -9,106 +55,345 @@
 #   Frontend automatically requests a bucket size based on the selected hours.
 #
 # Endpoints:
-#   GET /api/pings?start=<ms>&end=<ms>&bucket_ms=<int>   (if bucket_ms>0, returns aggregated rows)
+#   GET /api/pings?start=<ms>&end=<ms>&bucket_ms=<int>[&since_ms=<ms>]   (if bucket_ms>0, returns aggregated rows)
+#       since_ms: only rows at/after since_ms (bucketed: from since_ms's bucket on, which is re-sent
+#                 since it may have been partial); stats still cover the whole start..end window
+#       fmt=bin (bucketed only): application/octet-stream, same content as the JSON, all little-endian:
+#           u32 n_tags, u32 0, f64 stats.avg (NaN = null), f64 stats.lossPct
+#           per tag: char[12] tag (NUL-padded), u32 n,
+#                    f64[n] ts, f32[n] avg (NaN = null), u16[n] succ, u16[n] total
+#           (16 bytes per bucket, so every array starts 8-byte aligned)
 #       Raw rows:      [ts_ms, target, tag, rtt_ms, success]
-#       Aggregated:    [bucket_ts_ms,   tag, avg_rtt_ms, success_count, total_count]
+#       Aggregated:    {"stats": {"avg": <dest avg ms|null>, "lossPct": <dest loss %>},
+#                       "tags": {tag: {"ts": [...], "avg": [...], "succ": [...], "total": [...]}}}
 #   GET /api/speedtests?start=<ms>&end=<ms>
+#       {"servers": {sid: {"name", "tool"}},
+#        "rows": {"ts": [...], "sid": [...], "down": [...], "up": [...]}}
+#   GET /api/speedtests_windows
+#       {"w15": {"down", "up"}, "w1h": {"down", "up"}, "w24h": {"down", "up"}}   (avg Mbps, null if none)
 #   GET /api/latest_traceroute
 #
 # Run:
 #   HOST=0.0.0.0 PORT=8088 LOG_DIR=/path DEFAULT_WINDOW_HOURS=24 \
-#   python3 net_analytics_webui_standalone_v1_5.py
+#   python3 net_analytics_webui_standalone_v1_6.py
 
 import os
 import json
+import gzip
+import hashlib
+import socket
 import sqlite3
+import struct
+import threading
+from collections import OrderedDict
 from urllib.parse import urlparse, parse_qs
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
+try:
+    import numpy as np   # optional: server-side LTTB downsampling
+except ImportError:
+    np = None
+
 LOG_DIR = os.environ.get("LOG_DIR", "./net_analytics_log")
 DB_PATH = os.environ.get("DB_PATH", os.path.join(LOG_DIR, "net_analytics.db"))
 HOST = os.environ.get("HOST", "0.0.0.0")
 PORT = int(os.environ.get("PORT", "8088"))
 DEFAULT_WINDOW_HOURS = int(os.environ.get("DEFAULT_WINDOW_HOURS", "24"))
+HTTP_WORKERS = int(os.environ.get("HTTP_WORKERS", "8"))
+MAX_POINTS_PER_SERIES = 2500   # = the chart's decimation threshold, so the browser has nothing left to do
+
+_tls = threading.local()
 
 def get_conn():
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        return conn
     if not os.path.exists(DB_PATH):
         return None
-    return sqlite3.connect(DB_PATH, timeout=15)
-
-def query_pings_raw(start_ms, end_ms):
-    conn = get_conn()
+    # the collector owns the file (and its WAL journal mode); we only ever read
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=15,
+                           check_same_thread=False, isolation_level=None)
+    for pragma in ("PRAGMA query_only=1",
+                   "PRAGMA mmap_size=268435456",
+                   "PRAGMA cache_size=-65536",
+                   "PRAGMA temp_store=MEMORY"):
+        try:
+            conn.execute(pragma)
+        except sqlite3.DatabaseError:
+            pass
+    _tls.conn = conn
+    return conn
+
+# collector-maintained rollups, coarsest first: (table, bucket size in ms)
+PING_ROLLUPS = (("pings_1h", 3600000), ("pings_5m", 300000), ("pings_1m", 60000), ("pings_15s", 15000))
+
+# SQL is kept in constants so every request hits the connection's statement cache.
+SQL_PINGS_RAW = """
+    SELECT ts_ms, target, tag, rtt_ms, success
+    FROM pings
+    WHERE ts_ms BETWEEN ? AND ?
+    ORDER BY ts_ms ASC
+"""
+# bucket = floor(ts_ms / bucket_ms) * bucket_ms
+# avg RTT over successful pings only, plus success & total counts for loss/weighting
+SQL_PINGS_BUCKETED = """
+    SELECT ((ts_ms / ?) * ?) AS bucket_ts,
+           tag,
+           AVG(CASE WHEN success=1 THEN rtt_ms END) AS avg_rtt,
+           SUM(success) AS success_count,
+           COUNT(*) AS total_count
+    FROM pings
+    WHERE ts_ms BETWEEN ? AND ?
+    GROUP BY bucket_ts, tag
+    ORDER BY bucket_ts ASC
+"""
+SQL_ROLLUP_BUCKETED = {table: f"""
+    SELECT ((bucket_ts / ?) * ?) AS b,
+           tag,
+           SUM(sum_rtt) / NULLIF(SUM(succ), 0) AS avg_rtt,
+           SUM(succ) AS success_count,
+           SUM(total) AS total_count
+    FROM {table}
+    WHERE bucket_ts BETWEEN ? AND ?
+    GROUP BY b, tag
+    ORDER BY b ASC
+""" for table, _ in PING_ROLLUPS}
+SQL_DEST_STATS = """
+    SELECT TOTAL(CASE WHEN success=1 THEN rtt_ms END), SUM(success), COUNT(*)
+    FROM pings
+    WHERE tag = 'dest' AND ts_ms BETWEEN ? AND ?
+"""
+SQL_ROLLUP_DEST_STATS = {table: f"""
+    SELECT TOTAL(sum_rtt), SUM(succ), SUM(total)
+    FROM {table}
+    WHERE tag = 'dest' AND bucket_ts BETWEEN ? AND ?
+""" for table, _ in PING_ROLLUPS}
+SQL_SPEEDTESTS = """
+    SELECT ts_ms, tool, server_id, server_name, download_mbps, upload_mbps
+    FROM speedtests
+    WHERE ts_ms BETWEEN ? AND ?
+    ORDER BY ts_ms ASC
+"""
+# one range scan over the last 24h; the shorter windows are conditional averages
+SQL_SPEEDTEST_WINDOWS = """
+    SELECT AVG(CASE WHEN ts_ms >= ? THEN download_mbps END),
+           AVG(CASE WHEN ts_ms >= ? THEN upload_mbps END),
+           AVG(CASE WHEN ts_ms >= ? THEN download_mbps END),
+           AVG(CASE WHEN ts_ms >= ? THEN upload_mbps END),
+           AVG(download_mbps),
+           AVG(upload_mbps)
+    FROM speedtests
+    WHERE ts_ms >= ?
+"""
+# the collector keeps the latest traceroute's hops in traceroute_current
+SQL_LAST_TRACES = """
+    SELECT ts_ms, dest, hop, ip
+    FROM traceroute_current
+    ORDER BY hop ASC
+"""
+# DBs from before traceroute_current; MAX(ts_ms) is a single seek on the (ts_ms, hop, ip) index
+SQL_LAST_TRACES_RAW = """
+    SELECT ts_ms, dest, hop, ip
+    FROM traceroutes
+    WHERE ts_ms = (SELECT MAX(ts_ms) FROM traceroutes)
+    ORDER BY hop ASC
+"""
+
+def rollup_for(bucket_ms):
+    # coarsest rollup whose bucket divides bucket_ms (None: use raw pings)
+    for table, table_ms in PING_ROLLUPS:
+        if bucket_ms % table_ms == 0:
+            return table
+    return None
+
+def query_pings_raw(conn, start_ms, end_ms):
     if conn is None:
         return []
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT ts_ms, target, tag, rtt_ms, success
-        FROM pings
-        WHERE ts_ms BETWEEN ? AND ?
-        ORDER BY ts_ms ASC
-    """, (start_ms, end_ms))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def query_pings_bucketed(start_ms, end_ms, bucket_ms):
-    conn = get_conn()
+    return conn.execute(SQL_PINGS_RAW, (start_ms, end_ms)).fetchall()
+
+def query_pings_bucketed(conn, start_ms, end_ms, bucket_ms):
     if conn is None:
         return []
-    cur = conn.cursor()
-    # bucket = floor(ts_ms / bucket_ms) * bucket_ms
-    # avg RTT over successful pings only, plus success & total counts for loss/weighting
-    cur.execute(f"""
-        SELECT ((ts_ms / ?) * ?) AS bucket_ts,
-               tag,
-               AVG(CASE WHEN success=1 THEN rtt_ms END) AS avg_rtt,
-               SUM(success) AS success_count,
-               COUNT(*) AS total_count
-        FROM pings
-        WHERE ts_ms BETWEEN ? AND ?
-        GROUP BY bucket_ts, tag
-        ORDER BY bucket_ts ASC
-    """, (bucket_ms, bucket_ms, start_ms, end_ms))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def query_speedtests(start_ms, end_ms):
-    conn = get_conn()
+    # A rollup gives identical buckets from far fewer rows (callers pass bucket-aligned windows).
+    # Older DBs without rollups fall through to raw pings.
+    table = rollup_for(bucket_ms)
+    if table:
+        try:
+            return conn.execute(SQL_ROLLUP_BUCKETED[table], (bucket_ms, bucket_ms, start_ms, end_ms)).fetchall()
+        except sqlite3.OperationalError:
+            pass
+    return conn.execute(SQL_PINGS_BUCKETED, (bucket_ms, bucket_ms, start_ms, end_ms)).fetchall()
+
+def query_dest_stats(conn, start_ms, end_ms, bucket_ms):
     if conn is None:
-        return []
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT ts_ms, tool, server_id, server_name, ping_ms, download_mbps, upload_mbps, jitter_ms
-        FROM speedtests
-        WHERE ts_ms BETWEEN ? AND ?
-        ORDER BY ts_ms ASC
-    """, (start_ms, end_ms))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def query_last_traces():
-    conn = get_conn()
+        return {"avg": None, "lossPct": 0}
+    row = None
+    table = rollup_for(bucket_ms)
+    if table:
+        try:
+            row = conn.execute(SQL_ROLLUP_DEST_STATS[table], (start_ms, end_ms)).fetchone()
+        except sqlite3.OperationalError:
+            pass
+    if row is None:
+        row = conn.execute(SQL_DEST_STATS, (start_ms, end_ms)).fetchone()
+    sum_rtt, succ, total = row[0], row[1] or 0, row[2] or 0
+    return {"avg": sum_rtt / succ if succ else None,
+            "lossPct": 100.0 * (total - succ) / total if total else 0}
+
+def query_speedtests(conn, start_ms, end_ms):
+    servers = {}
+    # ping/jitter aren't charted (and jitter is always null for speedtest-cli), so they're not sent
+    cols = {"ts": [], "sid": [], "down": [], "up": []}
+    if conn is None:
+        return {"servers": servers, "rows": cols}
+    for ts_ms, tool, server_id, server_name, down, up in conn.execute(SQL_SPEEDTESTS, (start_ms, end_ms)):
+        sid = str(server_id) if server_id else "unknown"
+        if sid not in servers:
+            servers[sid] = {"name": server_name or "unknown", "tool": tool}
+        cols["ts"].append(ts_ms)
+        cols["sid"].append(sid)
+        cols["down"].append(down)
+        cols["up"].append(up)
+    return {"servers": servers, "rows": cols}
+
+def query_speedtest_windows(conn, now_ms):
+    if conn is None:
+        d15 = u15 = d1h = u1h = d24 = u24 = None
+    else:
+        d15, u15, d1h, u1h, d24, u24 = conn.execute(SQL_SPEEDTEST_WINDOWS, (
+            now_ms - 900000, now_ms - 900000, now_ms - 3600000, now_ms - 3600000, now_ms - 86400000)).fetchone()
+    return {"w15": {"down": d15, "up": u15},
+            "w1h": {"down": d1h, "up": u1h},
+            "w24h": {"down": d24, "up": u24}}
+
+def query_last_traces(conn):
     if conn is None:
         return []
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(ts_ms) FROM traceroutes")
-    row = cur.fetchone()
-    if not row or row[0] is None:
-        conn.close()
-        return []
-    max_ts = row[0]
-    cur.execute("""
-        SELECT ts_ms, dest, hop, ip
-        FROM traceroutes
-        WHERE ts_ms = ?
-        ORDER BY hop ASC
-    """, (max_ts,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    try:
+        return conn.execute(SQL_LAST_TRACES).fetchall()
+    except sqlite3.OperationalError:
+        return conn.execute(SQL_LAST_TRACES_RAW).fetchall()
+
+def db_version():
+    # WAL mode: commits land in the -wal file and leave the main file's mtime alone
+    v = 0
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            v = max(v, os.stat(path).st_mtime_ns)
+        except OSError:
+            pass
+    return v
+
+# Encoded /api/pings payloads, most recently used last. Hand-rolled rather than lru_cache so the
+# (per-worker) connection isn't part of the key.
+_payload_cache = OrderedDict()
+_payload_lock = threading.Lock()
+PAYLOAD_CACHE_SIZE = 64
+
+def pings_payload(conn, start_bucket, end_bucket, bucket_ms, version, since_bucket=None, fmt="json"):
+    # whole buckets only, so every request inside the same bucket range shares one entry
+    key = (start_bucket, end_bucket, bucket_ms, version, since_bucket, fmt)
+    with _payload_lock:
+        body = _payload_cache.get(key)
+        if body is not None:
+            _payload_cache.move_to_end(key)
+            return body
+    body = build_pings_payload(conn, start_bucket, end_bucket, bucket_ms, since_bucket, fmt)
+    with _payload_lock:
+        _payload_cache[key] = body
+        while len(_payload_cache) > PAYLOAD_CACHE_SIZE:
+            _payload_cache.popitem(last=False)
+    return body
+
+def build_pings_payload(conn, start_bucket, end_bucket, bucket_ms, since_bucket, fmt):
+    start_ms, end_ms = start_bucket * bucket_ms, (end_bucket + 1) * bucket_ms - 1
+    delta = since_bucket is not None and since_bucket > start_bucket
+    if delta:
+        # incremental refresh: just the tail, stats over the full window
+        rows = query_pings_bucketed(conn, since_bucket * bucket_ms, end_ms, bucket_ms)
+        stats = query_dest_stats(conn, start_ms, end_ms, bucket_ms)
+    else:
+        rows = query_pings_bucketed(conn, start_ms, end_ms, bucket_ms)
+        stats = None
+    tags = {}
+    for bucket_ts, tag, avg_rtt, succ, total in rows:
+        cols = tags.get(tag)
+        if cols is None:
+            cols = tags[tag] = {"ts": [], "avg": [], "succ": [], "total": []}
+        cols["ts"].append(bucket_ts)
+        cols["avg"].append(avg_rtt)
+        cols["succ"].append(succ)
+        cols["total"].append(total)
+    payload = {"stats": stats or dest_stats(tags.get("dest")), "tags": tags}
+    if np is not None and not delta:  # a delta is only the last few buckets
+        for tag, cols in tags.items():
+            tags[tag] = downsample(cols, MAX_POINTS_PER_SERIES)
+    if fmt == "bin":
+        return gzip.compress(pings_bin(payload), 5)
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"), 5)
+
+def pings_bin(payload):
+    nan = float("nan")
+    stats, tags = payload["stats"], payload["tags"]
+    parts = [struct.pack("<IIdd", len(tags), 0, nan if stats["avg"] is None else stats["avg"], stats["lossPct"])]
+    for tag, cols in tags.items():
+        n = len(cols["ts"])
+        parts.append(struct.pack("<12sI", tag.encode("ascii"), n))
+        parts.append(struct.pack(f"<{n}d", *cols["ts"]))
+        parts.append(struct.pack(f"<{n}f", *[nan if v is None else v for v in cols["avg"]]))
+        parts.append(struct.pack(f"<{n}H", *[min(v or 0, 65535) for v in cols["succ"]]))
+        parts.append(struct.pack(f"<{n}H", *[min(v or 0, 65535) for v in cols["total"]]))
+    return b"".join(parts)
+
+def lttb(ts, y, n_out):
+    # Largest-Triangle-Three-Buckets: indices of n_out points (first and last always kept).
+    n = len(ts)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)   # n_out-2 buckets over [1, n-1)
+    counts = np.diff(edges)
+    avg_ts = np.add.reduceat(ts[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            ct, cy = avg_ts[i + 1], avg_y[i + 1]
+        else:
+            ct, cy = ts[n - 1], y[n - 1]
+        # twice the triangle area (a, candidate, next bucket's mean), for every candidate at once
+        area = np.abs((ts[a] - ct) * (y[lo:hi] - y[a]) - (ts[a] - ts[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def downsample(cols, n_out):
+    # null buckets (all pings lost) aren't plotted, so they don't count against n_out
+    keep = [i for i, v in enumerate(cols["avg"]) if v is not None]
+    if len(keep) <= n_out:
+        return cols
+    ts = np.array([cols["ts"][i] for i in keep], dtype=np.float64)
+    ts -= ts[0]   # small magnitudes keep the area products precise
+    y = np.array([cols["avg"][i] for i in keep], dtype=np.float64)
+    idx = [keep[i] for i in lttb(ts, y, n_out).tolist()]
+    return {k: [v[i] for i in idx] for k, v in cols.items()}
+
+def dest_stats(cols):
+    # success-weighted mean of the bucket averages == mean RTT of every successful ping
+    succ = total = 0
+    wsum = 0.0
+    if cols:
+        for avg_rtt, sc, tc in zip(cols["avg"], cols["succ"], cols["total"]):
+            succ += sc or 0
+            total += tc or 0
+            if avg_rtt is not None and sc:
+                wsum += avg_rtt * sc
+    return {"avg": wsum / succ if succ else None,
+            "lossPct": 100.0 * (total - succ) / total if total else 0}
 
 INDEX_HTML = r"""<!doctype html>
 <html>
@@ -209,7 +494,6 @@ INDEX_HTML = r"""<!doctype html>
 
 <script>
 let pingChart, speedChart;
-const MAX_POINTS_PER_SERIES = 3000; // client-side thinning
 const HOP_KEY = 'netdash_hop_toggles_v1';
 const SPEED_HIDDEN_KEY = 'netdash_speed_hidden_v1';
 
@@ -242,46 +526,126 @@ async function fetchJSON(url) {
   return r.json();
 }
 
-function thin(points, maxPoints) {
-  if (!Array.isArray(points) || points.length <= maxPoints) return points;
-  const stride = Math.ceil(points.length / maxPoints);
-  const out = [];
-  for (let i = 0; i < points.length; i += stride) out.push(points[i]);
+// /api/pings?fmt=bin -> same shape as the JSON, with typed-array columns (layout: see server header)
+async function fetchPingsBin(url) {
+  const r = await fetch(url);
+  if (!r.ok) return null;
+  const buf = await r.arrayBuffer();
+  const dv = new DataView(buf);
+  const nTags = dv.getUint32(0, true);
+  const avg = dv.getFloat64(8, true);
+  const out = {stats: {avg: Number.isNaN(avg) ? null : avg, lossPct: dv.getFloat64(16, true)}, tags: {}};
+  const dec = new TextDecoder();
+  let off = 24;
+  for (let t = 0; t < nTags; t++) {
+    const tag = dec.decode(new Uint8Array(buf, off, 12)).replace(/\0+$/, '');
+    const n = dv.getUint32(off + 12, true);
+    off += 16;
+    const ts = new Float64Array(buf, off, n);  off += 8*n;
+    const av = new Float32Array(buf, off, n);  off += 4*n;
+    const succ = new Uint16Array(buf, off, n); off += 2*n;
+    const total = new Uint16Array(buf, off, n); off += 2*n;
+    out.tags[tag] = {ts, avg: av, succ, total};
+  }
   return out;
 }
 
-// Build series from bucketed rows: [bucket_ts, tag, avg_rtt, success_count, total_count]
-function seriesFromBucketed(rows) {
+// Build series from bucketed columns: {tags: {tag: {ts, avg, succ, total}}}
+function seriesFromBucketed(data) {
   const s = {hop1: [], hop2: [], hop3: [], dest: []};
-  rows.forEach(r => {
-    const ts = r[0], tag = r[1], avg = r[2];
-    if (avg != null && s[tag]) s[tag].push({x: ts, y: avg});
-  });
-  for (const k of Object.keys(s)) s[k] = thin(s[k], MAX_POINTS_PER_SERIES);
+  const tags = (data && data.tags) || {};
+  for (const k of Object.keys(s)) {
+    const c = tags[k];
+    if (!c) continue;
+    const ts = c.ts, avg = c.avg, out = [];
+    for (let i = 0; i < ts.length; i++) {
+      const y = avg[i];
+      if (y != null && y === y) out.push({x: ts[i], y});  // null (JSON) / NaN (binary) = all lost
+    }
+    s[k] = out;
+  }
   return s;
 }
 
-function destStatsFromBucketed(rows){
-  const dest = rows.filter(r => r[1] === 'dest');
-  let succ = 0, total = 0, wsum = 0;
-  dest.forEach(r => {
-    const avg = r[2], sc = r[3]||0, tc = r[4]||0;
-    succ += sc; total += tc;
-    if (avg != null && sc>0) wsum += avg * sc;
-  });
-  const lossPct = total ? (100*(total - succ)/total) : 0;
-  const avgrtt = succ ? (wsum / succ) : null;
-  return {avg: avgrtt, lossPct};
+// Points arrive sorted by x with no duplicates (ORDER BY ts / bucket), so Chart.js can skip
+// its own parsing and monotonicity checks.
+function buildLineDataset(label, data, hidden=false) {
+  return { label, data, hidden, parsing: false, normalized: true, spanGaps: false, stepped: false,
+           borderWidth: 1, pointRadius: 0 };
 }
 
-function buildLineDataset(label, data, hidden=false) {
-  return { label, data, hidden, parsing: false, borderWidth: 1, pointRadius: 0, tension: 0.2 };
+const DECIMATION_THRESHOLD = 2500;
+
+// Only worth running when a series is longer than the threshold; the server already
+// downsamples bucketed pings to it.
+function decimationFor(datasets) {
+  const enabled = datasets.some(ds => ds.data.length > DECIMATION_THRESHOLD);
+  return { enabled, algorithm: 'lttb', threshold: DECIMATION_THRESHOLD };
+}
+
+function baseChartOptions(yLabel) {
+  return {
+    animation: false,
+    parsing: false,
+    normalized: true,
+    elements: { line: { tension: 0 } },
+    scales: {
+      x: { type: 'time', time: { tooltipFormat: 'Pp' } },
+      y: { title: { display: true, text: yLabel } }
+    },
+    interaction: { mode: 'nearest', intersect: false },
+    maintainAspectRatio: false,
+    responsive: true
+  };
+}
+
+// Series currently plotted in pingChart. Kept outside the chart because the decimation
+// plugin swaps dataset.data for its decimated copy; we re-assign ours after merging.
+let pingState = null; // {hours, series: {hop1: [{x,y}], ...}}
+
+function lastPingTs(series) {
+  let last = null;
+  for (const pts of Object.values(series)) {
+    if (pts.length && (last === null || pts[pts.length-1].x > last)) last = pts[pts.length-1].x;
+  }
+  return last;
+}
+
+// since: bucket the server re-sent from (may have been partial); cutoff: window start
+function mergePings(series, fresh, since, cutoff) {
+  for (const [tag, pts] of Object.entries(series)) {
+    let keep = pts.length;
+    while (keep > 0 && pts[keep-1].x >= since) keep--;
+    pts.length = keep;
+    for (const p of fresh[tag] || []) pts.push(p);
+    let drop = 0;
+    while (drop < pts.length && pts[drop].x < cutoff) drop++;
+    if (drop) pts.splice(0, drop);
+  }
 }
 
-async function loadPings(hours) {
+function showPingStats(data) {
+  const stats = (data && data.stats) || {avg: null, lossPct: 0};
+  document.getElementById('avgDest').textContent = (stats.avg!=null)? stats.avg.toFixed(1)+' ms' : '—';
+  document.getElementById('lossDest').textContent = stats.lossPct.toFixed(1)+' %';
+}
+
+async function loadPings(hours, full=false) {
   const start = msAgo(hours);
   const bucket = pickBucketMs(hours);
-  const rows = await fetchJSON(`/api/pings?start=${start}&end=${Date.now()}&bucket_ms=${bucket}`);
+  const since = (!full && pingChart && pingState && pingState.hours === hours) ? lastPingTs(pingState.series) : null;
+  if (since !== null) {
+    const data = await fetchPingsBin(`/api/pings?start=${start}&end=${Date.now()}&bucket_ms=${bucket}&since_ms=${since}&fmt=bin`);
+    if (!data || !data.tags) return;  // keep what's on screen
+    mergePings(pingState.series, seriesFromBucketed(data), since, Math.floor(start / bucket) * bucket);
+    pingChart.data.datasets.forEach(ds => { ds.data = pingState.series[ds.label]; });
+    pingChart.options.plugins.decimation = decimationFor(pingChart.data.datasets);
+    pingChart.update('none');
+    showPingStats(data);
+    return;
+  }
+
+  const data = await fetchPingsBin(`/api/pings?start=${start}&end=${Date.now()}&bucket_ms=${bucket}&fmt=bin`);
 
   const hopToggles = loadHopToggles();
   // set checkbox UI to stored state (once at start or if changed externally)
@@ -290,62 +654,54 @@ async function loadPings(hours) {
   document.getElementById('tHop3').checked = hopToggles.hop3;
   document.getElementById('tDest').checked = hopToggles.dest;
 
-  const s = seriesFromBucketed(rows);
+  const s = seriesFromBucketed(data);
+  pingState = {hours, series: s};
+  const datasets = [
+    buildLineDataset('hop1', s.hop1, !hopToggles.hop1),
+    buildLineDataset('hop2', s.hop2, !hopToggles.hop2),
+    buildLineDataset('hop3', s.hop3, !hopToggles.hop3),
+    buildLineDataset('dest', s.dest, !hopToggles.dest),
+  ];
   const cfg = {
     type: 'line',
-    data: {
-      datasets: [
-        buildLineDataset('hop1', s.hop1, !hopToggles.hop1),
-        buildLineDataset('hop2', s.hop2, !hopToggles.hop2),
-        buildLineDataset('hop3', s.hop3, !hopToggles.hop3),
-        buildLineDataset('dest', s.dest, !hopToggles.dest),
-      ]
-    },
+    data: { datasets },
     options: {
-      scales: {
-        x: { type: 'time', time: { tooltipFormat: 'Pp' } },
-        y: { title: { display: true, text: 'ms' } }
-      },
+      ...baseChartOptions('ms'),
       plugins: {
         legend: { display: true, position: 'bottom' },
-        decimation: { enabled: true, algorithm: 'lttb', threshold: 2500 }
-      },
-      interaction: { mode: 'nearest', intersect: false },
-      maintainAspectRatio: false,
-      responsive: true
+        decimation: decimationFor(datasets)
+      }
     }
   };
   if (pingChart) pingChart.destroy();
   pingChart = new Chart(document.getElementById('pingChart').getContext('2d'), cfg);
-
-  const stats = destStatsFromBucketed(rows);
-  document.getElementById('avgDest').textContent = (stats.avg!=null)? stats.avg.toFixed(1)+' ms' : '—';
-  document.getElementById('lossDest').textContent = stats.lossPct.toFixed(1)+' %';
+  showPingStats(data);
 }
 
 // ---- Speedtests per server with persistent legend visibility ----
-function groupByServer(rows) {
+function groupByServer(data) {
   const map = new Map(); // server_id => {name, down:[{x,y}], up:[{x,y}]}
-  rows.forEach(r => {
-    const ts = r[0];
-    const sid = (r[2] || "unknown").toString();
-    const sname = (r[3] || "unknown").toString();
-    const down = r[5]; const up = r[6];
-    if (!map.has(sid)) map.set(sid, { name: sname, down: [], up: [] });
+  const c = data.rows, servers = data.servers;
+  for (let i = 0; i < c.ts.length; i++) {
+    const ts = c.ts[i], sid = c.sid[i], down = c.down[i], up = c.up[i];
+    if (!map.has(sid)) map.set(sid, { name: servers[sid]?.name || 'unknown', down: [], up: [] });
     if (typeof down === 'number') map.get(sid).down.push({x: ts, y: down});
     if (typeof up === 'number')   map.get(sid).up.push({x: ts, y: up});
-  });
-  for (const v of map.values()) {
-    v.down = thin(v.down, MAX_POINTS_PER_SERIES);
-    v.up   = thin(v.up,   MAX_POINTS_PER_SERIES);
   }
   return map;
 }
 
 async function loadSpeed(hours) {
   const start = msAgo(hours);
-  const rows = await fetchJSON(`/api/speedtests?start=${start}&end=${Date.now()}`);
-  const perServer = groupByServer(rows);
+  let [data, win] = await Promise.all([
+    fetchJSON(`/api/speedtests?start=${start}&end=${Date.now()}`),
+    fetchJSON('/api/speedtests_windows'),
+  ]);
+  if (!data || !data.rows) data = {servers: {}, rows: {ts: [], sid: [], down: [], up: []}};
+  const c = data.rows, n = c.ts.length;
+  const idxByTs = new Map();
+  for (let i = 0; i < n; i++) if (!idxByTs.has(c.ts[i])) idxByTs.set(c.ts[i], i);  // first row wins, like find()
+  const perServer = groupByServer(data);
 
   const hiddenMap = loadSpeedHidden();
   const datasets = [];
@@ -360,10 +716,7 @@ async function loadSpeed(hours) {
     type: 'line',
     data: { datasets },
     options: {
-      scales: {
-        x: { type: 'time', time: { tooltipFormat: 'Pp' } },
-        y: { title: { display: true, text: 'Mbps' } }
-      },
+      ...baseChartOptions('Mbps'),
       plugins: {
         legend: {
           display: true,
@@ -379,28 +732,24 @@ async function loadSpeed(hours) {
             ci.update();
           }
         },
-        decimation: { enabled: true, algorithm: 'lttb', threshold: 2500 },
+        decimation: decimationFor(datasets),
         tooltip: { callbacks: { afterTitle: items => {
           if (!items?.length) return '';
-          const ts = items[0].raw.x;
-          const row = rows.find(r => r[0] === ts) || null;
-          return row ? ` ${row[2]} ${row[3]}` : '';
+          const i = idxByTs.get(items[0].raw.x);
+          if (i === undefined) return '';
+          const sid = c.sid[i];
+          return ` ${sid} ${data.servers[sid]?.name ?? ''}`;
         } } }
-      },
-      interaction: { mode: 'nearest', intersect: false },
-      maintainAspectRatio: false,
-      responsive: true
+      }
     }
   };
   if (speedChart) speedChart.destroy();
   speedChart = new Chart(document.getElementById('speedChart').getContext('2d'), cfg);
 
-  if (rows.length) {
-    const last = rows[rows.length-1];
-    document.getElementById('lastSpeed').textContent = `${last[5]?.toFixed(1) ?? '—'}↓ / ${last[6]?.toFixed(1) ?? '—'}↑ Mbps`;
-    const w15  = avgWindow(rows, 15*60*1000);
-    const w1h  = avgWindow(rows, 60*60*1000);
-    const w24h = avgWindow(rows, 24*60*60*1000);
+  if (n) {
+    document.getElementById('lastSpeed').textContent = `${c.down[n-1]?.toFixed(1) ?? '—'}↓ / ${c.up[n-1]?.toFixed(1) ?? '—'}↑ Mbps`;
+    const none = {down: null, up: null};
+    const w15 = win.w15 || none, w1h = win.w1h || none, w24h = win.w24h || none;
     const fmt = v => (v==null ? '—' : v.toFixed(1));
     document.getElementById('avgSpeedWindows').textContent =
       `15m: ${fmt(w15.down)}↓ / ${fmt(w15.up)}↑ • 1h: ${fmt(w1h.down)}↓ / ${fmt(w1h.up)}↑ • 24h: ${fmt(w24h.down)}↓ / ${fmt(w24h.up)}↑`;
@@ -410,15 +759,6 @@ async function loadSpeed(hours) {
   }
 }
 
-function avgWindow(rows, windowMs) {
-  const cutoff = Date.now() - windowMs;
-  const win = rows.filter(r => r[0] >= cutoff);
-  const downs = win.map(r => r[5]).filter(v => typeof v === 'number');
-  const ups   = win.map(r => r[6]).filter(v => typeof v === 'number');
-  const avg = arr => arr.length ? (arr.reduce((a,b)=>a+b,0)/arr.length) : null;
-  return {down: avg(downs), up: avg(ups)};
-}
-
 async function loadTrace() {
   const rows = await fetchJSON('/api/latest_traceroute');
   const box = document.getElementById('traceBox');
@@ -430,9 +770,9 @@ async function loadTrace() {
   box.innerHTML = html;
 }
 
-async function reloadAll() {
+async function reloadAll(full=false) {
   const hrs = Math.max(1, Number(document.getElementById('hours').value || 24));
-  await Promise.all([loadPings(hrs), loadSpeed(hrs), loadTrace()]);
+  await Promise.all([loadPings(hrs, full), loadSpeed(hrs), loadTrace()]);
 }
 
 let _loopTimer = null;
@@ -443,7 +783,7 @@ function scheduleLoop() {
 }
 
 function applyAndReload() {
-  reloadAll();
+  reloadAll(true);
   scheduleLoop();
 }
 
@@ -468,7 +808,10 @@ document.addEventListener('DOMContentLoaded', () => {
         dest: document.getElementById('tDest').checked,
       };
       saveHopToggles(val);
-      loadPings(Math.max(1, Number(document.getElementById('hours').value || 24)));
+      if (pingChart) {
+        pingChart.data.datasets.forEach(ds => { ds.hidden = !val[ds.label]; });
+        pingChart.update('none');
+      }
     });
   });
 
@@ -479,52 +822,195 @@ document.addEventListener('DOMContentLoaded', () => {
 </html>
 """.replace("{{HOURS}}", str(DEFAULT_WINDOW_HOURS)).replace("{{DEST}}", os.environ.get("DEST_HOST", "8.8.8.8"))
 
+INDEX_BYTES = INDEX_HTML.encode("utf-8")
+INDEX_GZ = gzip.compress(INDEX_BYTES, 9)
+INDEX_ETAG = '"' + hashlib.sha1(INDEX_BYTES).hexdigest() + '"'
+
+_JSON = json.JSONEncoder(separators=(",", ":"))
+
+def json_pieces(obj, size=65536):
+    # iterencode yields tiny pieces; regroup them into ~size-byte blocks
+    buf, n = [], 0
+    for chunk in _JSON.iterencode(obj):
+        buf.append(chunk)
+        n += len(chunk)
+        if n >= size:
+            yield "".join(buf).encode("utf-8")
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+class ChunkedWriter:
+    # HTTP/1.1 chunked transfer encoding over the handler's wfile
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.wfile.write(b"0\r\n\r\n")
+
 class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 65536
+    timeout = 10   # idle keep-alive connections would otherwise pin a pool worker
+
+    def setup(self):
+        super().setup()
+        try:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path in ("/", "/index.html"):
-            self._send_html(INDEX_HTML); return
+            self._send_index(); return
+
+        # one connection for every query this request makes (this worker's, see get_conn)
+        conn = get_conn() if parsed.path.startswith("/api/") else None
 
         if parsed.path == "/api/pings":
             qs = parse_qs(parsed.query or "")
             start = int(qs.get("start", [0])[0])
             end = int(qs.get("end", [int(datetime.now(tz=timezone.utc).timestamp()*1000)])[0])
             bucket_ms = int(qs.get("bucket_ms", [0])[0])
+            since = qs.get("since_ms")
+            since = int(since[0]) if since else None
             if bucket_ms and bucket_ms > 0:
-                self._send_json(query_pings_bucketed(start, end, bucket_ms)); return
+                since_bucket = since // bucket_ms if since is not None else None
+                fmt = "bin" if qs.get("fmt", [""])[0] == "bin" else "json"
+                body = pings_payload(conn, start // bucket_ms, end // bucket_ms, bucket_ms, db_version(), since_bucket, fmt)
+                self._send_gzipped(body, "application/octet-stream" if fmt == "bin" else "application/json"); return
             else:
-                self._send_json(query_pings_raw(start, end)); return
+                self._send_json(query_pings_raw(conn, max(start, since) if since is not None else start, end)); return
 
         if parsed.path == "/api/speedtests":
             qs = parse_qs(parsed.query or "")
             start = int(qs.get("start", [0])[0])
             end = int(qs.get("end", [int(datetime.now(tz=timezone.utc).timestamp()*1000)])[0])
-            self._send_json(query_speedtests(start, end)); return
-
-        if parsed.path == "/api/latest_traceroute":
-            self._send_json(query_last_traces()); return
+            self._send_json(query_speedtests(conn, start, end)); return
 
-        self.send_response(404); self.end_headers(); self.wfile.write(b"not found")
+        if parsed.path == "/api/speedtests_windows":
+            self._send_json(query_speedtest_windows(conn, int(datetime.now(tz=timezone.utc).timestamp()*1000))); return
 
-    def _send_html(self, html):
+        if parsed.path == "/api/latest_traceroute":
+            self._send_json(query_last_traces(conn)); return
+
+        self._send_body(404, "text/plain; charset=utf-8", b"not found")
+
+    def _send_index(self):
+        inm = self.headers.get("If-None-Match", "")
+        if inm == "*" or INDEX_ETAG in (t.strip() for t in inm.split(",")):
+            self.send_response(304)
+            self.send_header("ETag", INDEX_ETAG)
+            self.end_headers()
+            return
+        gz = self._accepts_gzip()
+        body = INDEX_GZ if gz else INDEX_BYTES
         self.send_response(200)
         self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", INDEX_ETAG)
+        self.send_header("Cache-Control", "public, max-age=60")
+        self.send_header("Vary", "Accept-Encoding")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _accepts_gzip(self):
+        return "gzip" in self.headers.get("Accept-Encoding", "")
+
+    def _send_body(self, code, content_type, body, gz=False):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(html.encode("utf-8"))
+        self.wfile.write(body)
 
     def _send_json(self, obj):
+        gz = self._accepts_gzip()
+        pieces = json_pieces(obj)
+        first = next(pieces, b"")
+        second = next(pieces, None)
+        if second is None:
+            # fits in one block: send it whole with a Content-Length
+            self._send_body(200, "application/json", gzip.compress(first, 1) if gz else first, gz)
+            return
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
-        self.wfile.write(json.dumps(obj).encode("utf-8"))
+        chunked = ChunkedWriter(self.wfile)
+        out = gzip.GzipFile(fileobj=chunked, mode="wb", compresslevel=1) if gz else chunked
+        out.write(first)
+        out.write(second)
+        for piece in pieces:
+            out.write(piece)
+        if gz:
+            out.close()  # writes the gzip trailer; leaves the chunked stream open
+        chunked.close()
+
+    def _send_gzipped(self, body, content_type):
+        gz = self._accepts_gzip()
+        self._send_body(200, content_type, body if gz else gzip.decompress(body), gz)
+
+class PooledServer(ThreadingHTTPServer):
+    # ThreadingHTTPServer spawns a thread per request; hand requests to a bounded pool instead,
+    # so concurrency is capped and get_conn()'s thread-local connections are reused. Pool workers
+    # aren't daemon threads (daemon_threads has no effect here), so server_close shuts down the
+    # open connections: a worker waiting on an idle keep-alive socket would otherwise hold up
+    # interpreter exit for up to Handler.timeout.
+
+    def __init__(self, server_address, handler_class, workers=HTTP_WORKERS):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._open = set()
+        self._open_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._open_lock:
+            self._open.add(request)
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            with self._open_lock:
+                self._open.discard(request)
+
+    def server_close(self):
+        super().server_close()
+        with self._open_lock:
+            for request in self._open:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._pool.shutdown(wait=False, cancel_futures=True)
 
 def main():
     print(f"[INFO] Serving dashboard on http://{HOST}:{PORT}  (DB={DB_PATH})")
-    httpd = HTTPServer((HOST, PORT), Handler)
+    httpd = PooledServer((HOST, PORT), Handler)
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         pass
+    httpd.server_close()
     print("[INFO] Stopped.")
 
 if __name__ == "__main__":